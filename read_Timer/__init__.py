@@ -1,17 +1,32 @@
 import struct
 import re
-import pkg_resources
-import os
-import copy
+import itertools
+import mmap
+from collections.abc import MutableMapping, Sequence
+from functools import lru_cache
+from importlib.resources import files
 
+import numpy as np
 from loguru import logger
 
-from astropy import units as u
-from astropy.coordinates import SkyCoord, AltAz
-from astropy.time import Time
+# astropy is slow to import, so it is only imported where it is used
 
 _data_lengths = {"int": 4, "float": 4, "double": 8, "uint32_t": 4}
 _endian = ">"
+_type_codes = {"int": "i", "float": "f", "double": "d", "uint32_t": "I"}
+_numpy_codes = {"int": "i4", "float": "f4", "double": "f8", "uint32_t": "u4"}
+# precompiled formats for the numeric types, so they are not reparsed on every read
+_structs = {dtype: struct.Struct(_endian + code) for dtype, code in _type_codes.items()}
+# marks a cached value that has not been computed yet
+_unset = object()
+_comment_re = re.compile(r"//.*?\n|/\*.*?\*/", re.S)
+# matches either "#define NAME 123" or a struct member like "char name[LEN];"
+_definition_re = re.compile(
+    r"^\s*#define\s+(?P<define>\w+)\s+(?P<number>\d+)\s*$"
+    r"|^\s*(?:struct\s+)?(?P<vartype>\w+)\s+(?P<varname>\w+)"
+    r"(?:\[(?P<length>\w+)\])?\s*;",
+    re.M,
+)
 
 
 def stripcomments(text):
@@ -19,12 +34,16 @@ def stripcomments(text):
 
     https://stackoverflow.com/questions/241327/remove-c-and-c-comments-using-python
     """
-    return re.sub("//.*?\n|/\*.*?\*/", "", text, flags=re.S)
+    return _comment_re.sub("", text)
 
 
+@lru_cache(maxsize=None)
 def get_definition(filename):
     """get Timer file header definition
 
+    The result is cached and shared between callers, so use `_clone_keywords`
+    to get a copy that can be modified
+
     Parameters
     ----------
     filename : name of .h file defining struct
@@ -34,64 +53,103 @@ def get_definition(filename):
     keywords : dict
     dictionary of `Keyword`s
     """
-    _header_file = os.path.join(
-        pkg_resources.resource_filename(__name__, "data/"), filename
-    )
-
-    fh = open(
-        _header_file,
-        "r",
-    )
-
-    lines = stripcomments("".join(fh.readlines())).split("\n")
+    _header_file = files(__name__) / "data" / filename
 
     keywords = {}
-
-    # first extract the lengths of the different char[] variables
+    # lengths of the char[] variables from the #defines
     chararray_lengths = {}
-    for line in lines:
-        if line.startswith("#define"):
-            if len(line.split()) == 3:
-                try:
-                    chararray_lengths[line.split()[1]] = int(line.split()[2])
-                except ValueError:
-                    # not a char array
-                    pass
-    # now parse the rest
-    for line in lines:
-        if line.startswith("//") or line.startswith("#"):
+    # the #defines come before they are used, so this can be done in one pass
+    for match in _definition_re.finditer(stripcomments(_header_file.read_text())):
+        if match["define"] is not None:
+            chararray_lengths[match["define"]] = int(match["number"])
             continue
-        if len(line.strip()) == 0:
-            continue
-        if not ";" in line:
-            continue
-        goodline = line.split(";")[0]
-        if len(goodline.split()) == 2:
-            try:
-                vartype, varname = goodline.split()
-            except:
-                # assume still a comment?
-                continue
-        elif (
-            (len(goodline.split()) == 3)
-            and (goodline.split()[0] == "struct")
-            and not ("{" in goodline)
-        ):
-            vartype, varname = goodline.split()[1:]
-        else:
-            continue
-        if vartype == "char":
-            try:
-                length = int(varname.split("[")[1].replace("]", ""))
-            except ValueError:
-                length = chararray_lengths[varname.split("[")[1].replace("]", "")]
-            varname = varname.split("[")[0]
+        vartype, varname, length = match.group("vartype", "varname", "length")
         keywords[varname] = Keyword(name=varname, dtype=vartype)
         if vartype == "char":
-            keywords[varname].size = length
+            if length.isdigit():
+                keywords[varname].size = int(length)
+            else:
+                keywords[varname].size = chararray_lengths[length]
     return keywords
 
 
+def get_format(keywords):
+    """get the `struct` format string for a set of keywords
+
+    Nested `band` structs are expanded inline.
+
+    Parameters
+    ----------
+    keywords : dict
+    dictionary of `Keyword`s
+
+    Returns
+    -------
+    fmt : str
+    format string (without the byte-order character)
+    """
+    fmt = ""
+    for key in keywords:
+        if keywords[key].dtype == "char":
+            fmt += f"{keywords[key].size}s"
+        elif keywords[key].dtype == "band":
+            fmt += get_format(_band_keyword_definition)
+        else:
+            fmt += _type_codes[keywords[key].dtype]
+    return fmt
+
+
+def _clone_keyword(keyword):
+    """Return a fresh copy of a `Keyword`, without its value"""
+    return Keyword(name=keyword.name, size=keyword.size, dtype=keyword.dtype)
+
+
+def _clone_keywords(template):
+    """Return fresh copies of the `Keyword`s in a definition (much faster than deepcopy)"""
+    return {key: _clone_keyword(keyword) for key, keyword in template.items()}
+
+
+def get_dtype(keywords):
+    """get the numpy structured dtype for a set of keywords
+
+    Parameters
+    ----------
+    keywords : dict
+    dictionary of `Keyword`s
+
+    Returns
+    -------
+    dtype : np.dtype
+    big-endian structured dtype with one field per keyword
+    """
+    fields = []
+    for key in keywords:
+        if keywords[key].dtype == "char":
+            fields.append((key, f"S{keywords[key].size}"))
+        else:
+            fields.append((key, _endian + _numpy_codes[keywords[key].dtype]))
+    return np.dtype(fields)
+
+
+def _struct_reader(s):
+    """Make a reader for `Keyword.read` that unpacks a single value with Struct `s`"""
+    unpack, size = s.unpack, s.size
+    return lambda keyword, fptr: unpack(fptr.read(size))[0]
+
+
+def _read_char(keyword, fptr):
+    return keyword.decode(fptr.read(keyword.size))
+
+
+def _read_bytes(keyword, fptr):
+    return fptr.read(keyword.size)
+
+
+# dispatch table for `Keyword.read`, looked up once when the dtype is set
+_readers = {dtype: _struct_reader(s) for dtype, s in _structs.items()}
+_readers["char"] = _read_char
+
+
 class Keyword:
     def __init__(self, name=None, size=0, dtype=None, value=None):
         self.name = name
@@ -100,23 +158,21 @@ class Keyword:
         self.value = value
 
     def read(self, fptr):
-        out = fptr.read(self.size)
+        self.value = self._reader(self, fptr)
+
+    def set_raw(self, raw):
+        """Set the value from an already-unpacked result, decoding char arrays"""
+        self.value = self.decode(raw)
+
+    def decode(self, raw):
+        """Decode the bytes of a char array; other types are returned unchanged"""
         if self.dtype == "char":
             try:
-                result = out.decode().rstrip("\x00")
+                raw = raw.decode().rstrip("\x00")
             except UnicodeDecodeError:
                 logger.warning(f"Unable to decode contents of '{self.name}'")
-                result = None
-        elif self.dtype == "int":
-            result = struct.unpack(_endian + "i", out)[0]
-        elif self.dtype == "float":
-            result = struct.unpack(_endian + "f", out)[0]
-        elif self.dtype == "double":
-            result = struct.unpack(_endian + "d", out)[0]
-        elif self.dtype == "uint32_t":
-            # unsigned 4-byte integer?
-            result = struct.unpack(_endian + "I", out)[0]
-        self.value = result
+                raw = None
+        return raw
 
     @property
     def dtype(self):
@@ -127,6 +183,7 @@ class Keyword:
         self._dtype = value
         if self._dtype in _data_lengths:
             self.size = _data_lengths[self._dtype]
+        self._reader = _readers.get(value, _read_bytes)
 
     def __repr__(self):
         return str(self)
@@ -135,6 +192,46 @@ class Keyword:
         return f"{self.name}[{self.dtype}, {self.size} bytes] = {self.value}"
 
 
+class _LazyKeywords(MutableMapping):
+    """Mapping of names to `Keyword`s built from a definition and unpacked values
+
+    Each `Keyword` is only constructed when it is first accessed.
+    Otherwise it behaves like the dict of `Keyword`s it replaces.
+    """
+
+    def __init__(self, template, index, values):
+        self._template = template
+        self._index = index
+        self._values = values
+        self._keys = dict.fromkeys(template)
+        self._keywords = {}
+
+    def __getitem__(self, key):
+        if key not in self._keys:
+            raise KeyError(key)
+        if key not in self._keywords:
+            self._keywords[key] = _clone_keyword(self._template[key])
+            self._keywords[key].set_raw(self._values[self._index[key]])
+        return self._keywords[key]
+
+    def __setitem__(self, key, value):
+        self._keys[key] = None
+        self._keywords[key] = value
+
+    def __delitem__(self, key):
+        del self._keys[key]
+        self._keywords.pop(key, None)
+
+    def __iter__(self):
+        return iter(self._keys)
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __repr__(self):
+        return repr(dict(self))
+
+
 class Band:
     """Store the metadata only for each band
 
@@ -145,19 +242,24 @@ class Band:
     """
 
     def __init__(self, name=None):
-        self.keywords = copy.deepcopy(_band_keyword_definition)
+        self.keywords = _clone_keywords(_band_keyword_definition)
         self.name = name
         self.size = 0
         self.sequence = ""
         self.bandwidth = None
         self.frequency = None
-        for key in _band_keyword_definition:
-            self.size += _band_keyword_definition[key].size
-            self.sequence += _band_keyword_definition[key].dtype[0]
+        for keyword in self.keywords.values():
+            self.size += keyword.size
+            self.sequence += keyword.dtype[0]
 
     def read(self, fptr):
         out = fptr.read(self.size)
-        results = struct.unpack(_endian + self.sequence, out)
+        self.set_values(struct.unpack(_endian + self.sequence, out))
+
+    def set_values(self, results):
+        """Set the keyword values from a sequence of unpacked results"""
+        from astropy import units as u
+
         for k, r in zip(self.keywords, results):
             self.keywords[k].value = r
         self.frequency = self["centrefreq"].value * u.MHz
@@ -194,31 +296,83 @@ class Subint:
     pointing
     """
 
-    def __init__(self, number=None):
-        self.keywords = copy.deepcopy(_subint_keyword_definition)
+    def __init__(self, number=None, values=None):
         self.number = number
-        self.starttime = None
-        self.integration = None
-        self.pointing = None
+        if values is None:
+            # to be filled in later by `read`
+            self.keywords = _clone_keywords(_subint_keyword_definition)
+            self._reset_cache()
+        else:
+            self.set_values(values)
 
     @property
     def size(self):
-        size = 0
-        for k in self.keywords:
-            size += self.keywords[k].size
-        return size
+        # fixed by the definition, so no need to add up the keywords
+        return _subint_dtype.itemsize
 
     def read(self, fptr):
-        for varname in self.keywords:
-            self.keywords[varname].read(fptr)
-        self.starttime = Time(
-            self.keywords["mjd"].value + self.keywords["fracmjd"].value, format="mjd"
-        )
-        self.integration = self.keywords["integration"].value * u.s
-        self.pointing = AltAz(
-            alt=(90 * u.deg - self["tel_zen"].value * u.deg),
-            az=self["tel_az"].value * u.deg,
+        self.set_values(_subint_struct.unpack(fptr.read(_subint_struct.size)))
+
+    def set_values(self, results):
+        """Set the keyword values from a sequence of unpacked results"""
+        self.keywords = _LazyKeywords(
+            _subint_keyword_definition, _subint_index, tuple(results)
         )
+        self._reset_cache()
+
+    def _reset_cache(self):
+        # the astropy objects are only made when they are first needed
+        self._starttime = _unset
+        self._integration = _unset
+        self._pointing = _unset
+
+    @property
+    def starttime(self):
+        if self._starttime is _unset:
+            if self["mjd"].value is None:
+                return None
+            from astropy.time import Time
+
+            self._starttime = Time(
+                self["mjd"].value + self["fracmjd"].value, format="mjd"
+            )
+        return self._starttime
+
+    @starttime.setter
+    def starttime(self, value):
+        self._starttime = value
+
+    @property
+    def integration(self):
+        if self._integration is _unset:
+            if self["integration"].value is None:
+                return None
+            from astropy import units as u
+
+            self._integration = self["integration"].value * u.s
+        return self._integration
+
+    @integration.setter
+    def integration(self, value):
+        self._integration = value
+
+    @property
+    def pointing(self):
+        if self._pointing is _unset:
+            if self["tel_zen"].value is None:
+                return None
+            from astropy import units as u
+            from astropy.coordinates import AltAz
+
+            self._pointing = AltAz(
+                alt=(90 * u.deg - self["tel_zen"].value * u.deg),
+                az=self["tel_az"].value * u.deg,
+            )
+        return self._pointing
+
+    @pointing.setter
+    def pointing(self, value):
+        self._pointing = value
 
     def asstr(self):
         s = []
@@ -240,6 +394,36 @@ class Subint:
         self.keywords[key].value = value
 
 
+class SubintList(Sequence):
+    """Sequence of `Subint`s backed by a structured array of the subint headers
+
+    Each `Subint` is only constructed when it is first accessed
+    """
+
+    def __init__(self, headers):
+        self.headers = headers
+        self._subints = {}
+
+    def __len__(self):
+        return len(self.headers)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("subint index out of range")
+        if index not in self._subints:
+            self._subints[index] = Subint(
+                number=index, values=self.headers[index].item()
+            )
+        return self._subints[index]
+
+    def __repr__(self):
+        return f"<{len(self)} subints>"
+
+
 class TimerHeader:
     """Read a PSRCHIVE Timer header
     the header is a struct defined in "data/timer.h"
@@ -259,12 +443,14 @@ class TimerHeader:
     polyco
     ephem
 
-    and then it reads a list of subints
+    and then it reads the subints: their headers are kept in a structured array
+    (self.subint_headers), and self.subints gives a `Subint` for each on demand
     """
 
     def __init__(self, filename=None):
-        self.keywords = copy.deepcopy(_timer_keyword_definition)
+        self.keywords = _clone_keywords(_timer_keyword_definition)
         self.subints = []
+        self.subint_headers = None
         self.filename = filename
         self.psrname = None
         self.starttime = None
@@ -275,64 +461,85 @@ class TimerHeader:
             self.read(filename)
 
     def read(self, filename):
+        from astropy import units as u
+        from astropy.coordinates import SkyCoord
+        from astropy.time import Time
+
         logger.debug(f"Reading Timer file '{filename}'")
         self.filename = filename
-        f = open(filename, "rb")
-        for varname in self.keywords:
-            if self.keywords[varname].dtype == "band":
-                result = Band(name=varname)
-                result.read(f)
-                self.keywords[varname].value = result
-                self.keywords[varname].size = result.size
-            else:
-                self.keywords[varname].read(f)
-
-        # ignore the backend info
-        out = f.read(self.keywords["be_data_size"].value)
-
-        if self.keywords["nbytespoly"].value > 0:
-            out = f.read(self.keywords["nbytespoly"].value)
-            self.polyco = out.decode().rstrip("\x00")
-
-        out = f.read(self.keywords["nbytesephem"].value)
-        self.ephem = out.decode().rstrip("\x00")
-
-        # process some of the more useful keywords
-        # try this, although we might over-write it
-        self.starttime = Time(
-            self.keywords["mjd"].value + self.keywords["fracmjd"].value, format="mjd"
-        )
-        if self.keywords["coord_type"].value == "05":
-            self.position = SkyCoord(
-                self.keywords["ra"].value * u.rad, self.keywords["dec"].value * u.rad
-            )
-        elif self.keywords["coord_type"].value == "04":
-            self.position = SkyCoord(
-                self.keywords["l"].value * u.deg,
-                self.keywords["b"].value * u.deg,
-                frame="galactic",
-            )
-        else:
-            logger.warning(
-                f"Do not know how to interpret coordinate type {self.keywords['coord_type'].value}"
-            )
-            self.position = None
-
-        self.telescope = self.keywords["telid"].value
-        self.psrname = self.keywords["psrname"].value
-        self.nchannels = self.keywords["nsub_band"].value
-        # CHECK
-        # is this right?
-        # what about bandb?
-        self.npol = self.keywords["banda"].value["npol"].value
-        logger.debug(f"Reading {self.keywords['nsub_int'].value} subints")
-        self.duration = 0 * u.s
+        # the file is either mapped or read in one go, so it does not need
+        # a read buffer of its own
+        with open(filename, "rb", buffering=0) as f:
+            try:
+                buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except (OSError, ValueError):
+                # cannot map this file, so fall back to reading all of it
+                buf = f.read()
         try:
-            self.read_subints(f)
-            # set the start time to the start of the first subint
-            self.starttime = self.subints[0].starttime
-        except:
-            pass
+            # unpack the whole header at once
+            values = iter(_timer_struct.unpack_from(buf, 0))
+            for varname in self.keywords:
+                if self.keywords[varname].dtype == "band":
+                    result = Band(name=varname)
+                    result.set_values(itertools.islice(values, len(result.keywords)))
+                    self.keywords[varname].value = result
+                    self.keywords[varname].size = result.size
+                else:
+                    self.keywords[varname].set_raw(next(values))
+
+            # ignore the backend info
+            offset = _timer_struct.size + self.keywords["be_data_size"].value
+
+            nbytes = self.keywords["nbytespoly"].value
+            if nbytes > 0:
+                self.polyco = buf[offset : offset + nbytes].decode().rstrip("\x00")
+                offset += nbytes
+
+            nbytes = self.keywords["nbytesephem"].value
+            self.ephem = buf[offset : offset + nbytes].decode().rstrip("\x00")
+            offset += nbytes
+
+            # process some of the more useful keywords
+            # try this, although we might over-write it
+            mjd = self.keywords["mjd"].value
+            fracmjd = self.keywords["fracmjd"].value
+            if self.keywords["coord_type"].value == "05":
+                self.position = SkyCoord(
+                    self.keywords["ra"].value * u.rad,
+                    self.keywords["dec"].value * u.rad,
+                )
+            elif self.keywords["coord_type"].value == "04":
+                self.position = SkyCoord(
+                    self.keywords["l"].value * u.deg,
+                    self.keywords["b"].value * u.deg,
+                    frame="galactic",
+                )
+            else:
+                logger.warning(
+                    f"Do not know how to interpret coordinate type {self.keywords['coord_type'].value}"
+                )
+                self.position = None
+
+            self.telescope = self.keywords["telid"].value
+            self.psrname = self.keywords["psrname"].value
+            self.nchannels = self.keywords["nsub_band"].value
+            # CHECK
+            # is this right?
+            # what about bandb?
+            self.npol = self.keywords["banda"].value["npol"].value
+            logger.debug(f"Reading {self.keywords['nsub_int'].value} subints")
+            self.duration = 0 * u.s
+            try:
+                self.read_subints(buf, offset)
+                # set the start time to the start of the first subint
+                # straight from the array, without having to construct that `Subint`
+                mjd, fracmjd = self.subint_headers[["mjd", "fracmjd"]][0].item()
+            except:
+                pass
+        finally:
+            if isinstance(buf, mmap.mmap):
+                buf.close()
+        self.starttime = Time(mjd + fracmjd, format="mjd")
         logger.info(f"Telescope = {self.telescope}")
         logger.info(f"Pulsar = {self.psrname}")
         logger.info(f"Start = {self.starttime.mjd} = {self.starttime.iso}")
@@ -344,21 +551,45 @@ class TimerHeader:
         # )
         self.stoptime = self.starttime + self.duration
 
-    def read_subints(self, fptr):
-        for subint in range(self.keywords["nsub_int"].value):
-            logger.trace(f"Reading subint {subint} at position {fptr.tell()}")
-            self.subints.append(Subint(number=subint))
-            self.subints[-1].read(fptr)
-            self.duration += self.subints[-1].integration
-            fptr.seek(self.subint_data_size, 1)
+    def read_subints(self, buf, offset):
+        """Read the subint headers from `buf` (the whole file) starting at `offset`
+
+        The subint data themselves are skipped
+        """
+        from astropy import units as u
+
+        nsub_int = self.keywords["nsub_int"].value
+        # the subint headers are evenly spaced, so view them all at once
+        # and let numpy step over the data in between
+        stride = _subint_dtype.itemsize + self.subint_data_size
+        logger.trace(f"Reading subints from position {offset} every {stride} bytes")
+        # only take the headers that are actually in the file, in case it is
+        # truncated (or the data size is wrong)
+        nfit = max(0, (len(buf) - offset - _subint_dtype.itemsize) // stride + 1)
+        if nfit < nsub_int:
+            logger.warning(
+                f"Only {nfit} of {nsub_int} subints fit in the file; reading those"
+            )
+            nsub_int = nfit
+        # copy so that the array does not hold on to the file buffer
+        self.subint_headers = np.array(
+            np.ndarray(
+                (nsub_int,),
+                dtype=_subint_dtype,
+                buffer=buf,
+                offset=offset,
+                strides=(stride,),
+            )
+        )
+        self.subints = SubintList(self.subint_headers)
+        # sum the raw values rather than adding up Quantities one at a time
+        self.duration = float(self.subint_headers["integration"].sum()) * u.s
 
     @property
     def size(self):
         """This excludes the subints"""
-        size = 0
-        for k in self.keywords:
-            size += self.keywords[k].size
-        return size
+        # fixed by the definition, including the bands before they have been read
+        return _timer_struct.size
 
     @property
     def subint_data_size(self):
@@ -416,3 +647,7 @@ class TimerHeader:
 _timer_keyword_definition = get_definition("timer.h")
 _band_keyword_definition = get_definition("band.h")
 _subint_keyword_definition = get_definition("mini.h")
+_timer_struct = struct.Struct(_endian + get_format(_timer_keyword_definition))
+_subint_struct = struct.Struct(_endian + get_format(_subint_keyword_definition))
+_subint_dtype = get_dtype(_subint_keyword_definition)
+_subint_index = {key: i for i, key in enumerate(_subint_keyword_definition)}
@@ -8,8 +8,8 @@ setup(
     author_email="kaplan@uwm.edu",
     url="",
     packages=find_packages(),
-    install_requires=["astropy", "loguru"],
-    python_requires=">=3.7",
+    install_requires=["astropy", "loguru", "numpy"],
+    python_requires=">=3.9",
     package_data={"read_Timer": ["data/*.*"]},
     include_package_data=True,
     zip_safe=False,